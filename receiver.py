@@ -7,14 +7,44 @@
 import datetime, time  # to calculate the time delta of packet transmission
 import logging, sys  # to write the log
 import socket  # to send packet via UDP socket
-from threading import Thread  # to manage threads
-from random import seed, randrange  # to randomise values
+from queue import SimpleQueue  # to hand over raw frames between threads
+from threading import Thread, Event  # to manage threads
+from random import Random  # to randomise values
 import struct  # to encode or decode bytes
 
 
+# print per-segment trace to stdout
+# off by default, stdout I/O outweighs the socket work at high packet rates
+# per-segment lines are stamped with the log time rather than the wall clock
+DEBUG = False
+
+
+# receiver states
+LISTEN = 0
+ESTAB = 1
+TIME_WAIT = 2
+
+
+# module logger, %-style arguments are only formatted if the record is emitted
+log = logging.getLogger(__name__)
+
+
+# segment type decoding table
+# index with stp type, any type beyond 4 is treated as RESET
+_TYPE_NAMES = ("DATA", "ACK", "SYN", "FIN", "RESET")
+
+
+# inverse of 125 mod 8192, recovers pkt pos from a data seqno offset
+_INV125 = pow(125, -1, 8192)
+
+
 class Receiver:
     
     
+    # stp header codec: type (2 bytes) + seqno (2 bytes)
+    _HDR = struct.Struct('2H')
+
+
     # receiver constructor
     def __init__(self, receiver_port: int, sender_port: int, filename: str, flp: float, rlp: float) -> None:
         
@@ -35,16 +65,31 @@ class Receiver:
         self.flp = int(float(flp) * 100)  # convert to 100%
         self.rlp = int(float(rlp) * 100)  # convert to 100%
 
-        # buffer
-        self.buffer = {}  # dictionary for managing received data
-        # use dictionary so our receive buffer can hold variable length of data
+        # loss sampler, bound once to keep attribute lookups off the per-packet path
+        self._rand = Random().random  # uniform float in [0, 1)
+
+        # buffer, indexed by pkt pos
+        self._slots = [None] * 1024  # array for managing received data
+        self._present = bytearray(1024)  # presence bitmap, 1 if pkt at pos is received
+        # both grow on demand so our receive buffer can hold variable length of data
+
+        # contiguous prefix of buffer, advanced as in-order data arrives
+        self._next_contig = 0  # pos of the first missing pkt
+        self._contig_bytes = 0  # number of bytes before that pkt
+
+        # reusable receive buffer, MSS + 4-byte header
+        self._rxbuf = bytearray(1004)
+        self._rxmv = memoryview(self._rxbuf)
+
+        # raw frames handed from the reader sub-thread to the listener sub-thread
+        self._rxq = SimpleQueue()
 
         # seqno constant
         self.DSN = 0  # first data seqno
 
         # state variables
-        self.established = False
-        self.n_fin = 0
+        self._state = LISTEN
+        self._handlers = (self.listen_hdlr, self.estab_hdlr, self.time_wait_hdlr)  # indexed by state
 
         # initial timestamp
         self.itstamp = 0
@@ -59,29 +104,17 @@ class Receiver:
         print(f"{datetime.datetime.now()}\tIP Address: {self.receiver_address}")
         self.receiver_socket = socket.socket(family=socket.AF_INET, type=socket.SOCK_DGRAM)
         self.receiver_socket.bind(self.receiver_address)
+        # enlarge kernel receive queue so bursts are not dropped while the listener is busy
+        self.receiver_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4*1024*1024)
 
-        # start the listener sub-thread
-        self.active = True  # control termination of program
+        # start the reader and listener sub-threads
+        self._done = Event()  # control termination of program
+        reader_thread = Thread(target=self.fw_reader, daemon=True)
+        reader_thread.start()
         listener_thread = Thread(target=self.fw_listener, daemon=True)
         listener_thread.start()
 
 
-    # segment type decoding utility
-    # convert stp type from int to str
-    def get_type(self, i):
-        
-        if i == 0:
-            return "DATA"
-        elif i == 1:
-            return "ACK"
-        elif i == 2:
-            return "SYN"
-        elif i == 3:
-            return "FIN"
-        else:
-            return "RESET"
-
-
     # timestamp utility for logging
     def get_time(self):
         
@@ -92,168 +125,219 @@ class Receiver:
         return round(time.time() * 1000 - self.itstamp, 2)
 
 
+    # segment logging utility
+    # write one trace line to the log, echo it to stdout in DEBUG mode
+    # return the timestamp so callers can reuse it for related trace lines
+    def _log(self, tag, flag, seqno, size):
+
+        t = self.get_time()
+        log.info("%s\t%s\t%s\t%s\t%s", tag, t, _TYPE_NAMES[min(flag, 4)], seqno, size)
+        if DEBUG:
+            print(f"{t}\t{tag} | type: {flag} | seqno: {seqno} | size: {size}")
+
+        return t
+
+
     # segment sending utility
     def send_msg(self, flag, seqno):
         
         # expected segments: ACK = 1, RESET = 4
         # server will never send segments other than ACKs and RESETs
         # always prioritise logging due to time sentitivity concern 
-        
-        seed()
 
         # implement reverse loss probability function
-        if flag != 4 and randrange(100) < self.rlp:
-            logging.info(f"drp\t{self.get_time()}\t{self.get_type(flag)}\t{seqno}\t0")
-            print(f"{datetime.datetime.now()}\tdrp | type: {flag} | seqno: {seqno} | size: 0")
+        # skip sampling entirely when rlp is 0
+        if flag != 4 and self.rlp and self._rand() * 100 < self.rlp:
+            self._log("drp", flag, seqno, 0)
             self.drpack += 1
             return
 
         # compose 4 bytes packet, no payload is sent
-        logging.info(f"snd\t{self.get_time()}\t{self.get_type(flag)}\t{seqno}\t0")
-        print(f"{datetime.datetime.now()}\tsnd | type: {flag} | seqno: {seqno} | size: 0")
+        self._log("snd", flag, seqno, 0)
+
+        self.receiver_socket.sendto(self._HDR.pack(flag, seqno), self.sender_address)
 
-        self.receiver_socket.sendto(struct.pack('2H', flag, seqno), self.sender_address)
+
+    # sub-thread forward reader
+    # independent of main thread
+    # drain the socket as fast as possible, leave all processing to the listener
+    def fw_reader(self):
+
+        print(f"{datetime.datetime.now()}\t✓ LISTEN")
+
+        while not self._done.is_set():
+
+            # try to receive any incoming message from the sender
+            # read into the reusable buffer rather than allocating per packet
+            n = self.receiver_socket.recv_into(self._rxbuf, 1004)  # MSS + 4-byte header
+
+            # hand over a copy of the frame
+            self._rxq.put(bytes(self._rxmv[:n]))
 
 
     # sub-thread forward listener
     # independent of main thread
-    # listen for response from sender
+    # process frames read from sender
     def fw_listener(self):
         
         # expected segments: DATA = 0, SYN = 2, FIN = 3, RESET = 4
         # sender will not receive ACKs
-
-        print(f"{datetime.datetime.now()}\t✓ LISTEN")
         
-        while self.active:
+        while not self._done.is_set():
             
-            # try to receive any incoming message from the sender
-            incoming_message, _ = self.receiver_socket.recvfrom(1004)  # MSS + 4-byte header
+            # block until the reader hands over a frame
+            frame = self._rxq.get()
             
             # decode message
-            stp_type = int(struct.unpack('2H', incoming_message[0:4])[0])
-            stp_seqno = int(struct.unpack('2H', incoming_message[0:4])[1])
-            stp_size = len(incoming_message[4:])
+            stp_type, stp_seqno = self._HDR.unpack_from(frame, 0)
+            stp_size = len(frame) - 4
 
             # if SYN (type = 2) is received
             # reset timestamp until it is well received
             if stp_type == 2: 
                 self.itstamp = 0
 
-            seed()
-
             # implement forward loss probability function
-            if stp_type != 4 and randrange(100) < self.flp:
-                logging.info(f"drp\t{self.get_time()}\t{self.get_type(stp_type)}\t{stp_seqno}\t{stp_size}")
-                print(f"{datetime.datetime.now()}\tdrp | type: {stp_type} | seqno: {stp_seqno} | size: {stp_size}")
+            # skip sampling entirely when flp is 0
+            if stp_type != 4 and self.flp and self._rand() * 100 < self.flp:
+                self._log("drp", stp_type, stp_seqno, stp_size)
                 if stp_type == 0:
                     self.drpdata += 1
                 continue
 
             # print out decoded message
-            logging.info(f"rcv\t{self.get_time()}\t{self.get_type(stp_type)}\t{stp_seqno}\t{stp_size}")
-            print(f"{datetime.datetime.now()}\trcv | type: {stp_type} | seqno: {stp_seqno} | size: {stp_size}")
+            t = self._log("rcv", stp_type, stp_seqno, stp_size)
 
             # if RESET (type = 4) is received
             if stp_type == 4:
-                if not self.established:
+                if self._state == LISTEN:
                     print(f"{datetime.datetime.now()}\t✗ ESTAB")
                 else:
                     print(f"{datetime.datetime.now()}\t✗ FINISH")
-                self.active = False  # terminate
+                self._done.set()  # terminate
                 break
 
-            # In ESTAB phase ...
-            if not self.established:
-                
-                # if SYN (type = 2) is received
-                if stp_type == 2: 
+            # dispatch to the handler of current state
+            self._handlers[self._state](stp_type, stp_seqno, frame, t)
 
-                    self.established = True  # change state
 
-                    # compute first data sequence number
-                    self.DSN = (stp_seqno + 1) % (2**16)
+    # LISTEN state handler
+    # In ESTAB phase ...
+    def listen_hdlr(self, stp_type, stp_seqno, frame, t):
 
-                    # send ACK
-                    self.send_msg(1, self.DSN)
+        # if SYN (type = 2) is received
+        if stp_type == 2: 
 
-                    print(f"{datetime.datetime.now()}\t✓ ESTAB")
+            self._state = ESTAB  # change state
 
-                # otherwise
-                else:
+            # compute first data sequence number
+            self.DSN = (stp_seqno + 1) % (2**16)
 
-                    print(f"{datetime.datetime.now()}\t✗ ESTAB")
-                    self.reset()
-                    break
+            # send ACK
+            self.send_msg(1, self.DSN)
 
-            # After ESTAB phase ...
-            elif self.established:
-                
-                # if DATA (type = 0) is received
-                if stp_type == 0:
+            print(f"{datetime.datetime.now()}\t✓ ESTAB")
 
-                    # if received data frame during FIN phase
-                    if self.n_fin != 0:
-                        print(f"{datetime.datetime.now()}\t✗ FINISH")
-                        self.reset()
-                        break
-
-                    pos = 0  # pos of pkt in which the sender sends
-
-                    # compute pos of pkt in which the sender sends
-                    # cycle back to 0 whenever seqno go beyond 2**16 - 1
-                    # best algorithm I have come up with :)
-                    # can support many cycles
-                    for i in range(0, 15):  # support up to 983 KB file
-                        if (stp_seqno + 65536*i - self.DSN) % 1000 == 0:
-                            pos = int((stp_seqno + 65536*i - self.DSN) / 1000)
-                            break
-                    
-                    print(f"{datetime.datetime.now()}\t↑ pkt #{pos}")
-
-                    # if pkt not in buffer
-                    if pos not in self.buffer.keys():
-                        self.buffer[pos] = incoming_message[4:]
-                        self.lendata += len(self.buffer[pos])
-                    
-                    # otherwise
-                    else:
-                        print(f"{datetime.datetime.now()}\t... duplicated data segment ...")
-                        self.dupdata += 1
-
-                    # compute cumulative ACK
-                    cumu_seqno = self.DSN
-
-                    for i in range(0, 1000):
-                        if i not in self.buffer.keys():
-                            break
-                        else:
-                            cumu_seqno += len(self.buffer[i])
-
-                    cumu_seqno = cumu_seqno % (2**16)
-
-                    # send ACK
-                    self.send_msg(1, cumu_seqno)
-
-                # if FIN (type = 3) is received
-                elif stp_type == 3:
-
-                    self.n_fin += 1
-
-                    # send ACK
-                    self.send_msg(1, (stp_seqno + 1) % (2**16))
-
-                    # start timer in subthread, only at its first reception
-                    if self.n_fin == 1:
-                        a = Thread(target=self.timed_close, daemon=True)
-                        a.start()
+        # otherwise
+        else:
 
+            print(f"{datetime.datetime.now()}\t✗ ESTAB")
+            self.reset()
+
+
+    # ESTABLISHED state handler
+    # After ESTAB phase ...
+    def estab_hdlr(self, stp_type, stp_seqno, frame, t):
+
+        # if DATA (type = 0) is received
+        if stp_type == 0:
+
+            # compute pos of pkt in which the sender sends
+            # cycle back to 0 whenever seqno go beyond 2**16 - 1
+            # byte offset is 1000*pos mod 2**16, so pos is only known mod 8192 (1000 = 8*125)
+            # take the pkt within half a cycle of the first missing one, as the window is far smaller
+            offset = (stp_seqno - self.DSN) % (2**16)
+            pos = -1
+            if offset % 8 == 0:
+                base = self._next_contig - 4096
+                pos = base + ((offset // 8) * _INV125 - base) % 8192
+
+            # not a data seqno, or before the first data segment
+            if pos < 0:
+                if DEBUG:
+                    print(f"{t}\t... unexpected data seqno ...")
+
+            else:
+                if DEBUG:
+                    print(f"{t}\t↑ pkt #{pos}")
+
+                # grow buffer if pkt lies beyond its end
+                if pos >= len(self._slots):
+                    grow = max(pos + 1, 2 * len(self._slots)) - len(self._slots)
+                    self._slots.extend([None] * grow)
+                    self._present.extend(bytes(grow))
+
+                # if pkt not in buffer
+                if not self._present[pos]:
+                    self._slots[pos] = memoryview(frame)[4:]  # payload view, no copy
+                    self._present[pos] = 1
+                    self.lendata += len(frame) - 4
+
+                    # advance contiguous prefix only when the gap is filled
+                    # find the next missing pkt with a C-level scan of the bitmap
+                    if pos == self._next_contig:
+                        end = self._present.find(0, pos)
+                        if end == -1:
+                            end = len(self._present)
+                        self._contig_bytes += sum(map(len, self._slots[pos:end]))
+                        self._next_contig = end
+            
                 # otherwise
                 else:
+                    if DEBUG:
+                        print(f"{t}\t... duplicated data segment ...")
+                    self.dupdata += 1
 
-                    print(f"{datetime.datetime.now()}\t✗ FINISH")
-                    self.reset()
-                    break
+            # compute cumulative ACK
+            cumu_seqno = (self.DSN + self._contig_bytes) % (2**16)
+
+            # send ACK
+            self.send_msg(1, cumu_seqno)
+
+        # if FIN (type = 3) is received
+        elif stp_type == 3:
+
+            self._state = TIME_WAIT  # change state
+
+            # send ACK
+            self.send_msg(1, (stp_seqno + 1) % (2**16))
+
+            # start timer in subthread, only at its first reception
+            a = Thread(target=self.timed_close, daemon=True)
+            a.start()
+
+        # otherwise
+        else:
+
+            print(f"{datetime.datetime.now()}\t✗ FINISH")
+            self.reset()
+
+
+    # TIME_WAIT state handler
+    # After FIN is received ...
+    def time_wait_hdlr(self, stp_type, stp_seqno, frame, t):
+
+        # if FIN (type = 3) is received again, its ACK was lost
+        if stp_type == 3:
+
+            # send ACK
+            self.send_msg(1, (stp_seqno + 1) % (2**16))
+
+        # otherwise, including data frame during FIN phase
+        else:
+
+            print(f"{datetime.datetime.now()}\t✗ FINISH")
+            self.reset()
 
 
     # timed close
@@ -266,7 +350,7 @@ class Receiver:
         print(f"{datetime.datetime.now()}\t✓ FINISH")
 
         # terminate all sub-threads
-        self.active = False
+        self._done.set()
 
 
     # send RESET and close
@@ -276,37 +360,39 @@ class Receiver:
         self.send_msg(4, 0)
 
         # terminate all sub-threads
-        self.active = False
+        self._done.set()
 
 
     # main thread
     def run(self):
         
-        # main loop to hold main thread
-        while self.active:
-            pass
+        # hold main thread until the listener signals termination
+        self._done.wait()
 
         # output result string, regardless of success
         # maintain output even when transmission is not completed
-        scope = sorted(self.buffer.keys())
-        result = b""
-        for i in scope:
-            if i != 0 and i-1 not in scope:
-                break
-            result += self.buffer[i]
+        # take the contiguous run of pkts from pos 0, stop at the first gap
+        # its total size is already known, so allocate the result once and fill it in place
+        result = bytearray(self._contig_bytes)
+        off = 0
+        for i in range(self._next_contig):
+            chunk = self._slots[i]
+            result[off:off + len(chunk)] = chunk
+            off += len(chunk)
 
         # write to file
         with open(self.filename, 'w') as f:
             f.write(result.decode('utf-8')) # only decode the string once it's fully composed
 
-        print(f"{datetime.datetime.now()}\tReceived Segments: {sorted(self.buffer.keys())}")
+        if DEBUG:
+            print(f"{datetime.datetime.now()}\tReceived Segments: {[i for i, p in enumerate(self._present) if p]}")
         
         # write stats to log
-        logging.info(f"Data Received: {self.lendata} bytes")
-        logging.info(f"Data Segments Received: {len(self.buffer.keys())}")
-        logging.info(f"Duplicate Data Segments Received: {self.dupdata}")
-        logging.info(f"Data Segments Dropped: {self.drpdata}")
-        logging.info(f"ACK Segments Dropped: {self.drpack}")
+        log.info("Data Received: %s bytes", self.lendata)
+        log.info("Data Segments Received: %s", self._present.count(1))
+        log.info("Duplicate Data Segments Received: %s", self.dupdata)
+        log.info("Data Segments Dropped: %s", self.drpdata)
+        log.info("ACK Segments Dropped: %s", self.drpack)
 
         print(f"{datetime.datetime.now()}\t✓ CLOSE")
 
@@ -7,14 +7,78 @@
 import datetime, time  # to calculate the time delta of packet transmission
 import logging, sys  # to write the log
 import socket  # to send packet via UDP socket
-from threading import Thread  # to manage threads
+from threading import Thread, Lock, Event, current_thread  # to manage threads
 from random import seed, randrange  # to randomise values
 import struct  # to encode or decode bytes
+import heapq, selectors  # to run retransmission timers on the listener's event loop
+import ctypes, ctypes.util, errno, os  # to batch segments and ACKs into single sendmmsg/recvmmsg syscalls
+import mmap  # to page file data in on demand
+
+
+# print per-segment trace to stdout
+# off by default, stdout I/O outweighs the socket work at high packet rates
+# per-segment lines are stamped with the log time rather than the wall clock
+DEBUG = False
+
+
+# module logger, %-style arguments are only formatted if the record is emitted
+log = logging.getLogger(__name__)
+
+
+# segment type decoding table
+# index with stp type, any type beyond 4 is treated as RESET
+_TYPE_NAMES = ("DATA", "ACK", "SYN", "FIN", "RESET")
+
+
+# max number of segments flushed per sendmmsg call
+_BATCH_MAX = 100
+
+# max number of ACKs drained per recvmmsg call
+_RECV_MAX = 32
+
+
+# libc structures for sendmmsg/recvmmsg (see sendmmsg(2) and recvmmsg(2), Linux only)
+class _iovec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+class _msghdr(ctypes.Structure):
+    _fields_ = [("msg_name", ctypes.c_void_p), ("msg_namelen", ctypes.c_uint32),
+                ("msg_iov", ctypes.POINTER(_iovec)), ("msg_iovlen", ctypes.c_size_t),
+                ("msg_control", ctypes.c_void_p), ("msg_controllen", ctypes.c_size_t),
+                ("msg_flags", ctypes.c_int)]
+
+class _mmsghdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", _msghdr), ("msg_len", ctypes.c_uint)]
+
+class _sockaddr_in(ctypes.Structure):
+    _fields_ = [("sin_family", ctypes.c_ushort), ("sin_port", ctypes.c_uint16),
+                ("sin_addr", ctypes.c_uint8 * 4), ("sin_zero", ctypes.c_uint8 * 8)]
+
+
+# load sendmmsg from libc, fall back to one sendto per segment if unavailable
+try:
+    _sendmmsg = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True).sendmmsg
+    _sendmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int]
+    _sendmmsg.restype = ctypes.c_int
+except (OSError, AttributeError):
+    _sendmmsg = None
+
+# load recvmmsg from libc, fall back to one non-blocking recvfrom per ACK if unavailable
+try:
+    _recvmmsg = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True).recvmmsg
+    _recvmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+    _recvmmsg.restype = ctypes.c_int
+except (OSError, AttributeError):
+    _recvmmsg = None
 
 
 class Sender:
 
 
+    # stp header codec: type (2 bytes) + seqno (2 bytes)
+    _HDR = struct.Struct('2H')
+
+
     # sender constructor
     def __init__(self, sender_port: int, receiver_port: int, filename: str, max_win: int, rto: int) -> None:
                 
@@ -36,20 +100,26 @@ class Sender:
         self.rto = int(rto) / 1000  # in terms of seconds
 
         # arrays and buffers
-        self.buffer = []  # array for managing data segment payload (index: pkt id)
-        self.segmtRcved = []  # array for manging segment received status (index: pkt id)
-        self.segmtSent = []  # array for managing segment sent status (index: pkt id)
-        self.segmtTimer = []  # array for managing timer trigger status (index: pkt id)
-        self.segmtAck = {}  # dictionary for managing triple dup ack (index: pkt id)
+        self.data = bytearray()  # whole file content (mapped once read), payload of pkt i starts at byte i*1000
+        self._data_mv = memoryview(self.data)  # zero-copy view for slicing payloads out of data
+        self._hdr_for = []  # array for managing precomputed 4-byte data segment headers (index: pkt id)
+        self.lens = []  # array for managing data segment payload length (index: pkt id)
+        self.seqno_to_pos = {}  # dictionary for mapping ACK seqno back to candidate pkt ids (index: seqno)
+        self.acked_upto = -1  # highest pkt id covered by cumulative ACK, everything up to it is received
+        self.sent_count = 0  # number of pkts sent, sent pkts always form the prefix 0 .. sent_count - 1
+        self.timer_active_for = -1  # pkt id of the window lower bound whose timer is set
+        self._dup_pos = -1  # pkt id being dup acked, -1 when none (for managing triple dup ack)
+        self._dup_count = 0  # number of dup acks counted for _dup_pos
+        self.timers = []  # heap of (deadline, pkt id) for managing retransmission timers
+        self.timer_lock = Lock()  # guard timer heap shared by main and listener threads
 
         # data constants
         self.buffer_size = 0 # number of partitions
         self.data_size = 0 # number of bytes
 
         # state variables
-        self.established = False
         self.sendingdata = False
-        self.finished = False
+        self.window_changed_ev = Event()  # set by listener whenever the sending window slides
         self.terminate = False # for reset
 
         # window boundaries
@@ -75,149 +145,171 @@ class Sender:
         print(f"{datetime.datetime.now()}\tIP Address: {self.sender_address}")
         self.sender_socket = socket.socket(family=socket.AF_INET, type=socket.SOCK_DGRAM)
         self.sender_socket.bind(self.sender_address)
-
-        # start the listener sub-thread
+        # enlarge kernel queues so window bursts and ACK bursts are not dropped
+        self.sender_socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4*1024*1024)
+        self.sender_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4*1024*1024)
+        # forbid fragmentation, an oversized segment then fails loudly instead of being split (Linux only)
+        # 1004-byte segments fit any common MTU, so this only guards against silent fragmentation
+        if sys.platform.startswith("linux"):
+            self.sender_socket.setsockopt(socket.IPPROTO_IP, getattr(socket, "IP_MTU_DISCOVER", 10),
+                                          getattr(socket, "IP_PMTUDISC_DO", 2))
+
+        # receiver address in C layout for sendmmsg
+        self._c_addr = _sockaddr_in(socket.AF_INET, socket.htons(self.receiver_port),
+                                    (ctypes.c_uint8 * 4)(*socket.inet_aton(self.receiver_address[0])))
+
+        # reusable recvmmsg vector, one 4-byte buffer per ACK
+        self._rx_bufs = ((ctypes.c_char * 4) * _RECV_MAX)()
+        self._rx_iov = (_iovec * _RECV_MAX)()
+        self._rx_msgs = (_mmsghdr * _RECV_MAX)()
+        for k in range(_RECV_MAX):
+            self._rx_iov[k].iov_base = ctypes.addressof(self._rx_bufs[k])
+            self._rx_iov[k].iov_len = 4
+            self._rx_msgs[k].msg_hdr.msg_iov = ctypes.pointer(self._rx_iov[k])
+            self._rx_msgs[k].msg_hdr.msg_iovlen = 1
+
+        # listener sub-thread, started once connection is established
         self.active = True  # control termination of program
-        listener_thread = Thread(target=self.rv_listener, daemon=True)
-        listener_thread.start()
+        self.listener_thread = Thread(target=self.rv_listener, daemon=True)
 
 
-    # timed FIN executor
-    # handled in sub-thread, called recursively until the 4th retrials
-    def fin_exec(self, i):  # i is used for managing recusion loop (recommend init to 1)
+    # timed control segment (SYN / FIN) executor
+    # handled in main thread, which owns the socket while no listener is running
+    # send segment and block on the socket for its ACK, retried in a loop until the 4th retrials
+    # return True once ACKed, False on failure
+    def ctrl_exec(self, flag, seqno, ack_seqno, phase):
 
-        # send FIN
-        self.send_msg(3, self.FSN, 0)
-        # set timer
-        time.sleep(self.rto)
-        
-        # retrial
-        if not self.finished:
-            
-            # fast termination
-            if self.terminate or not self.active:
-                return
-            
-            # recursive base
-            # give up at 4th retrial
-            if i == 4:
-                self.terminate = True
-                return
+        # a zero timeout would make the socket non-blocking, so wait at least 1 ms (rto may be 0)
+        self.sender_socket.settimeout(max(self.rto, 0.001))
 
-            # retransmit SYN
-            print(f"{datetime.datetime.now()}\tFIN Retrial {i}")
-            
-            # recursive call
-            self.fin_exec(i+1) 
+        try:
+            for i in range(1, 5):
+
+                # send SYN / FIN
+                self.send_msg(flag, seqno, 0)
+
+                # set timer, return as soon as a response arrives
+                try:
+                    incoming_message, _ = self.sender_socket.recvfrom(4)  # 4-byte header
+                except socket.timeout:
+
+                    # give up at 4th retrial
+                    if i == 4:
+                        self.terminate = True
+                        return False
+
+                    # retransmit SYN / FIN
+                    print(f"{datetime.datetime.now()}\t{phase} Retrial {i}")
+                    continue
+
+                # decode segment
+                stp_type, stp_seqno = self._HDR.unpack_from(incoming_message, 0)
+                self._log("rcv", stp_type, stp_seqno, 0)
+
+                # if RESET (type = 4) is received
+                if stp_type == 4:
+                    self.active = False  # terminate program
+                    return False
+
+                # if ACK (type = 1) is received with correct seqno
+                if stp_type == 1 and stp_seqno == ack_seqno:
+                    self.PSN = stp_seqno
+                    return True
+
+                # otherwise
+                self.terminate = True  # send RESET
+                return False
+
+        finally:
+            self.sender_socket.settimeout(None)
 
 
     # main FIN handler
-    # handled in main thread, listen for control signals from sub-threads
+    # handled in main thread, once the listener has stopped
     def fin_hdlr(self):
-        
-        # setup timed sub-thread
-        d = Thread(target=self.fin_exec, args=(1,), daemon=True)
-        d.start()
 
-        # state listener
-        # loop until connection is finished
-        while not self.finished:
+        # hand the socket back from the listener
+        self.listener_thread.join()
 
+        # a failed exchange leaves either terminate set (send RESET) or active cleared (RESET received)
+        if self.terminate or not self.active or not self.ctrl_exec(3, self.FSN, (self.FSN + 1) % (2**16), "FIN"):
+            print(f"{datetime.datetime.now()}\t✗ FINISH")
             if self.terminate:
-                print(f"{datetime.datetime.now()}\t✗ FINISH")
                 self.reset()
-                break
-            
-            elif not self.active:
-                print(f"{datetime.datetime.now()}\t✗ FINISH")
+            else:
                 self.close()
-                break
 
         print(f"{datetime.datetime.now()}\t✓ FINISH")
 
 
-    # timed ESTAB executor
-    # handled in sub-thread, called recursively until the 4th retrials
-    def estab_exec(self, i): # i is used for managing recusion loop (recommend init to 1)
-
-        # send SYN
-        self.send_msg(2, self.ISN, 0)
-        # set timer
-        time.sleep(self.rto)
-        
-        # retrial
-        if not self.established:
-            
-            # fast termination
-            if self.terminate or not self.active:
-                return
-            
-            # recursive call
-            # give up at 4th retrial
-            if i == 4:
-                self.terminate = True
-                return
-
-            # retransmit SYN
-            print(f"{datetime.datetime.now()}\tESTAB Retrial {i}")
-            
-            # recursive call
-            self.estab_exec(i+1)
-
-
     # main ESTAB handler
-    # handled in main thread, listen for control signals from sub-threads
+    # handled in main thread, listener is started once connection is established
     def estab_hdlr(self): 
 
         print(f"{datetime.datetime.now()}\t")
         print(f"{datetime.datetime.now()}\tISN: {self.ISN}")
         
-        # setup timed sub-thread
-        a = Thread(target=self.estab_exec, args=(1,), daemon=True)
-        a.start()
-
-        # state listener
-        # loop until connection is established
-        while not self.established:
-            
+        # a failed exchange leaves either terminate set (send RESET) or active cleared (RESET received)
+        if not self.ctrl_exec(2, self.ISN, self.DSN, "ESTAB"):
+            print(f"{datetime.datetime.now()}\t✗ ESTAB")
             if self.terminate:
-                print(f"{datetime.datetime.now()}\t✗ ESTAB")
                 self.reset()
-                break
-            
-            elif not self.active:
-                print(f"{datetime.datetime.now()}\t✗ ESTAB")
+            else:
                 self.close()
-                break
+
+        # start the listener sub-thread
+        self.sendingdata = True
+        self.listener_thread.start()
 
         print(f"{datetime.datetime.now()}\t✓ ESTAB")
 
 
+    # retransmission timer utility
+    # schedule pkt i on the listener's timer heap, one rto from now
+    def set_timer(self, i):
+
+        if DEBUG:
+            print(f"{datetime.datetime.now()}\ttimer set for pkt #{i}")
+
+        with self.timer_lock:
+            heapq.heappush(self.timers, (time.monotonic() + self.rto, i))
+
+
     # timed segment retransmission executor
-    # handled in sub-thread, called recursively until the 4th retrials
+    # handled in listener sub-thread, pop every expired timer
     # data is retransmitted unlimitedly until it is received by server
-    def retranseg_exec(self, i):  # i denotes pkt id
-        
-        # set timer
-        time.sleep(self.rto)
+    def fire_timers(self):
 
-        # fast termination
-        if self.terminate or not self.active:
-            return
-        
-        # if segment is not yet received
-        if self.segmtRcved[i] == 0:
-            
-            # restransmit segment
-            print(f"{datetime.datetime.now()}\tretransmit pkt #{i}")
-            print(f"{datetime.datetime.now()}\ttimer set for #{i}")
-            self.retransmit += 1
-            
-            self.send_msg(0, (self.DSN + 1000 * i) % (2**16), i)
-            
-            # recursive call, no recursive base is supplied
-            # can possibly run in infinite loop
-            self.retranseg_exec(i)
+        now = time.monotonic()
+
+        # pop every expired timer before re-arming any
+        # a re-armed timer may expire at now itself (rto = 0), and must wait for the next round
+        expired = []
+        with self.timer_lock:
+            while self.timers and self.timers[0][0] <= now:
+                expired.append(heapq.heappop(self.timers)[1])
+
+        for i in expired:
+
+            # fast termination
+            if self.terminate or not self.active:
+                return
+
+            # if segment is not yet received
+            if i > self.acked_upto:
+
+                # restransmit segment
+                if DEBUG:
+                    print(f"{datetime.datetime.now()}\tretransmit pkt #{i}")
+                    print(f"{datetime.datetime.now()}\ttimer set for #{i}")
+                self.retransmit += 1
+
+                self.send_msg(0, (self.DSN + 1000 * i) % (2**16), i)
+
+                # re-arm timer, no base is supplied
+                # can possibly run indefinitely until pkt is received
+                with self.timer_lock:
+                    heapq.heappush(self.timers, (now + self.rto, i))
 
 
     # main segment transmission handler and executor
@@ -245,11 +337,15 @@ class Sender:
 
             # avoid window boundaries from dynamically changing
             # execute loop send in static manner
+            # clear first, so a slide during this pass is not missed
+            self.window_changed_ev.clear()
             lb = self.win_lb
             ub = self.win_ub
 
             # executor
             # loop send segments within sending window
+            # segments are collected and flushed in batches to save syscalls
+            batch = []
             for i in range(lb, ub+1):
 
                 # fast termination
@@ -257,221 +353,222 @@ class Sender:
                     break
                 
                 # if data is not sent
-                if self.segmtSent[i] == 0:
+                if i >= self.sent_count:
                     
                     # marked as sent
-                    self.segmtSent[i] = 1
-                    self.byteSent += len(self.buffer[i])
+                    self.sent_count += 1
+                    self.byteSent += self.lens[i]
                     
                     # check if it is the oldest packet in the sending window
                     if i == lb:
 
                         # if so, set timer
-                        self.segmtTimer[i] = 1
-                        
-                        # start timed sub-thread
-                        print(f"{datetime.datetime.now()}\ttimer set for pkt #{i}")
-                        b = Thread(target=self.retranseg_exec, args=(i,), daemon=True)
-                        b.start()
+                        self.timer_active_for = i
+                        self.set_timer(i)
 
-                    # send data segment
-                    self.send_msg(0, (self.DSN + 1000 * i) % (2**16), i)
+                    # queue data segment
+                    batch.append(self.patch_data((self.DSN + 1000 * i) % (2**16), i))
+                    if len(batch) == _BATCH_MAX:
+                        self._sendmmsg_batch(batch)
+                        batch = []
 
                 # if data is sent already, and now it becomes the oldest packet in the window
                 # and if no timer is already set for that packet
                 # this maintains a timer for all the oldest unacked packet in the window
-                elif i == lb and self.segmtTimer[i] == 0:
+                elif i == lb and self.timer_active_for != i:
                         
                         # set timer
-                        self.segmtTimer[i] = 1
+                        self.timer_active_for = i
+                        self.set_timer(i)
 
-                        # start timer thread
-                        print(f"{datetime.datetime.now()}\ttimer set for pkt #{i}")
-                        c = Thread(target=self.retranseg_exec, args=(i,), daemon=True)
-                        c.start()
+            # flush remaining segments of this pass
+            if batch:
+                self._sendmmsg_batch(batch)
+
+            # block until the window slides, waking periodically to check control signals
+            self.window_changed_ev.wait(timeout=0.1)
 
         print(f"{datetime.datetime.now()}\t✓ DATA")
 
 
     # sub-thread reverse listener
     # independent of main thread
-    # listen for response from receiver
+    # listen for response from receiver, and fire retransmission timers
     def rv_listener(self):
         
         # expected segments: ACK = 1, RESET = 4
         # sender will not receive packets other than ACK or RESET
 
         print(f"{datetime.datetime.now()}\t✓ LISTEN")
+
+        # single event loop shared by the listener and all retransmission timers
+        sel = selectors.DefaultSelector()
+        sel.register(self.sender_socket, selectors.EVENT_READ)
         
         while self.active:
 
+            # wait until a message arrives or the earliest timer expires
+            # with no timer pending, waiting one rto is never late: any timer set meanwhile expires after that
+            with self.timer_lock:
+                timeout = self.timers[0][0] - time.monotonic() if self.timers else self.rto
+
             # this is triggered when a message is received
-            # expect 4 bytes message since receiver does not send data
-            incoming_message, _ = self.sender_socket.recvfrom(4)  # 4-byte header
-            
-            # decode segment
-            stp_type = int(struct.unpack('2H', incoming_message[0:4])[0])
-            stp_seqno = int(struct.unpack('2H', incoming_message[0:4])[1])
+            # drain every queued ACK at once, and process them in arrival order
+            if sel.select(timeout=max(0, timeout)):
+                if not all(self.rv_process(incoming_message) for incoming_message in self._recvmmsg_batch()):
+                    break
 
-            logging.info(f"rcv\t{self.get_time()}\t{self.get_type(stp_type)}\t{stp_seqno}\t0")
-            print(f"{datetime.datetime.now()}\trcv | type: {stp_type} | seqno: {stp_seqno} | size: 0")
+            self.fire_timers()
 
-            # if RESET (type = 4) is received
-            if stp_type == 4:
-                self.active = False  # terminate program
-                break
+        sel.close()
+
+
+    # segment processing utility for the reverse listener
+    # return False when the listener should stop
+    def rv_process(self, incoming_message):
+
+        # decode segment
+        stp_type, stp_seqno = self._HDR.unpack_from(incoming_message, 0)
+
+        t = self._log("rcv", stp_type, stp_seqno, 0)
+
+        # if RESET (type = 4) is received
+        if stp_type == 4:
+            self.active = False  # terminate program
+            return False
+        
+        # After setting up the connection, we begin sending data
+        # In Data Transmission phase ...
+        
+        # if ACK (type = 1) is received
+        if stp_type == 1:
+        
+            # compute which pkt receiver wants
+            # cycle back to 0 whenever seqno go beyond 2**16 - 1
+            # ACKs are cumulative, so on collision the smallest candidate not below the window is the one requested
+            # pos of -1 means no pkt matches, which is treated as an unexpected low ack
+            candidates = self.seqno_to_pos.get(stp_seqno)
+
+            if candidates is None:
+                pos = -1
+            elif len(candidates) == 1:
+                pos = candidates[0]
+            else:
+                pos = next((c for c in candidates if c >= self.win_lb), -1)  # candidates are ascending
+
+            # clean up dup ack counter
+            if self.PSN != stp_seqno:
+                self._dup_pos = -1
             
-            # In ESTAB phase ...
-            if not self.established:
-                
-                # if ACK (type = 1) is received with correct seqno
-                if stp_type == 1 and stp_seqno == self.DSN:
-                    self.established = True  # change state
-                    self.sendingdata = True 
+            # main data ACK handler, decide actions to which ACK is received
+            # designed to deal with cumulative ACK, assume everything before ACK is received
+            # if receiver wants back the oldest pkt in window, that means pkt win_lb is lost
+            # it must be a dup ack because win_lb becomes the lower bound due to sliding window
+            if pos == self.win_lb:  # oldest packet in sending window
 
-                # otherwise
-                else:
-                    self.terminate = True  # send RESET
-                    break
+                if DEBUG:
+                    print(f"{t}\t... dup ack for pkt #{pos} ...")
 
-            # After setting up the connection, we begin sending data
-            # In Data Transmission phase ...
-            elif self.sendingdata:
+                self.dupAck += 1
+                
+                # manage for triple dup ack
+                if self.PSN == stp_seqno: # if previous seqno = current seqno
+                    if self._dup_pos != pos:
+                        self._dup_pos = pos
+                        self._dup_count = 1
+                    else:
+                        self._dup_count += 1
+                        
+                        # trigger fast retransmition on triple dup ack
+                        if self._dup_count % 3 == 0:
+                           
+                            if DEBUG:
+                                print(f"{t}\t... fast retransmit pkt #{pos} ...")
+                            self.send_msg(0, (self.DSN + 1000 * pos) % (2**16), pos)
+                            self.retransmit += 1
+            
+            # if receiver wants latter segment
+            # that means everything before pos is received
+            elif pos > self.win_lb:
                 
-                # if ACK (type = 1) is received
-                if stp_type == 1:
+                # flag as ACKed for everything before ACKed seqno
+                self.acked_upto = max(self.acked_upto, pos - 1)
                 
-                    pos = 0  # pos of pkt in which the receiver requests
-
-                    # compute which pkt receiver wants
-                    # cycle back to 0 whenever seqno go beyond 2**16 - 1
-                    # best algorithm I have come up with :)
-                    # can support many cycles
-                    for i in range(0, 15):  # support up to 983 KB file
-                        if (stp_seqno + 65536*i - self.DSN) % 1000 == 0:
-                            pos = int((stp_seqno + 65536*i - self.DSN) / 1000)
-                            break
-                        elif stp_seqno + 65536*i - self.DSN == self.data_size:
-                            pos = self.buffer_size  # in case of last data segment not filling up 1000 bytes
-                            break
-
-                    # clean up dup ack buffer
-                    if self.PSN != stp_seqno:
-                        self.segmtAck = {}
+                # when pos goes beyond the data window
+                # that means we have finished sending all the data
+                if pos == self.buffer_size:
                     
-                    # main data ACK handler, decide actions to which ACK is received
-                    # designed to deal with cumulative ACK, assume everything before ACK is received
-                    # if receiver wants back the oldest pkt in window, that means pkt win_lb is lost
-                    # it must be a dup ack because win_lb becomes the lower bound due to sliding window
-                    if pos == self.win_lb:  # oldest packet in sending window
-
-                        print(f"{datetime.datetime.now()}\t... dup ack for pkt #{pos} ...")
-
-                        self.dupAck += 1
-                        
-                        # manage for triple dup ack
-                        if self.PSN == stp_seqno: # if previous seqno = current seqno
-                            if pos not in self.segmtAck.keys():
-                                self.segmtAck[pos] = 1
-                            else:
-                                self.segmtAck[pos] += 1
-                                
-                                # trigger fast retransmition on triple dup ack
-                                if self.segmtAck[pos] % 3 == 0:
-                                   
-                                    print(f"{datetime.datetime.now()}\t... fast retransmit pkt #{pos} ...")
-                                    self.send_msg(0, (self.DSN + 1000 * pos) % (2**16), pos)
-                                    self.retransmit += 1
+                    self.FSN = stp_seqno
+                    self.sendingdata = False  # change state
+                    self.window_changed_ev.set()
                     
-                    # if receiver wants latter segment
-                    # that means everything before pos is received
-                    elif pos > self.win_lb:
-                        
-                        # flag as ACKed for everything before ACKed seqno
-                        for j in range(0, pos):
-                            self.segmtRcved[j] = 1
-                        
-                        # when pos goes beyond the data window
-                        # that means we have finished sending all the data
-                        if pos == self.buffer_size:
-                            
-                            self.sendingdata = False  # change state
-                            self.FSN = stp_seqno
-                            
-                            print(f"{datetime.datetime.now()}\tsegmtSent: {self.segmtSent}")
-                            print(f"{datetime.datetime.now()}\tsegmtRcved: {self.segmtRcved}")
-                            print(f"{datetime.datetime.now()}\tsegmtTimer: {self.segmtTimer}")
-                        
-                        # slide the window if we have not finished sending all the data
-                        else:
-                            self.win_ub = min(pos + self.win_size - 1, self.buffer_size - 1)
-                            self.win_lb = pos
-                            print(f"{datetime.datetime.now()}\t↑ window slided to {self.win_lb} - {self.win_ub}")
-
-                    # unexpected ACK when pos < win_lb
-                    # if receiver wants something that is smaller than the current window lower bound
-                    # it must be an error or premature delay, since window has already slided
-                    else: 
-                        print(f"{datetime.datetime.now()}\t... unexpected low ack ....")
-                        # which might still happen, but rarely
-                        # no action is taken because higher cumulative ACK has already received
+                    print(f"{datetime.datetime.now()}\tsent: {self.sent_count} | acked up to: #{self.acked_upto}")
                 
-                # otherwise
+                # slide the window if we have not finished sending all the data
                 else:
-                    self.terminate = True  # send RESET
-                    break
+                    self.win_ub = min(pos + self.win_size - 1, self.buffer_size - 1)
+                    self.win_lb = pos
+                    self.window_changed_ev.set()
+                    if DEBUG:
+                        print(f"{t}\t↑ window slided to {self.win_lb} - {self.win_ub}")
+
+            # unexpected ACK when pos < win_lb
+            # if receiver wants something that is smaller than the current window lower bound
+            # it must be an error or premature delay, since window has already slided
+            else: 
+                if DEBUG:
+                    print(f"{t}\t... unexpected low ack ....")
+                # which might still happen, but rarely
+                # no action is taken because higher cumulative ACK has already received
+        
+        # otherwise
+        else:
+            self.terminate = True  # send RESET
+            return False
 
-            # After finished sending all the data, we enter the finish phase
-            # In Finish phase ...
-            else:
-                
-                # if ACK (type = 1) is received with correct seqno
-                if stp_type == 1 and stp_seqno == (self.FSN + 1) % (2**16):
-                    self.finished = True  # change state
-                
-                # otherwise
-                else:
-                    self.terminate = True  # send RESET
-                    break
+        # store current seqno as previous seqno for dup ack computation
+        self.PSN = stp_seqno
 
-            # store current seqno as previous seqno for dup ack computation
-            self.PSN = stp_seqno
+        # keep listening until all data is ACKed, the main thread then takes over the socket for FIN
+        return self.sendingdata
 
 
     # read file and import data
     def read_file(self):
 
-        # read file
-        with open(self.filename, 'r') as f:
-            data = f.read().encode('utf-8') # encode file content to bytes
-
-        # record size of data
-        self.data_size = len(data)
+        # map file as raw bytes, pages are read in on demand as payloads are sliced out on send
+        # copy-on-write access keeps the mapping writable for ctypes, but is never written to
+        with open(self.filename, 'rb') as f:
+            try:
+                self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+            except ValueError:  # empty file cannot be mapped
+                self.data = bytearray()
+        self.data_size = len(self.data)  # record size of data
+        self._data_mv = memoryview(self.data)
         
         print(f"{datetime.datetime.now()}\t")
         print(f"{datetime.datetime.now()}\t{self.filename} has {self.data_size} bytes of data")
 
         # compute partition of split per 1000 bytes of data
-        self.buffer_size = int(self.data_size / 1000)
-
-        if self.data_size % 1000 != 0:
-            self.buffer_size += 1
+        self.buffer_size = (self.data_size + 999) // 1000
 
         print(f"{datetime.datetime.now()}\t{self.buffer_size} paritions, each holds at most 1000 bytes")
         print(f"{datetime.datetime.now()}\t✓ READ")
         print(f"{datetime.datetime.now()}\t")
 
-        # load data into buffer
-        for i in range(0, self.buffer_size):
-            if i == self.buffer_size - 1:
-                self.buffer.append(data[i*1000:len(data)])
-            else: 
-                self.buffer.append(data[i*1000:(i+1)*1000])
+        # compose every data segment header once, so (re)transmissions need no packing
+        # header and payload are gathered by the kernel, no concatenation needed
+        # every payload is a full 1000 bytes except possibly the last one
+        self.lens = [1000] * self.buffer_size
+        if self.buffer_size:
+            self.lens[-1] = self.data_size - 1000 * (self.buffer_size - 1)
+        self._hdr_for = [self._HDR.pack(0, (self.DSN + 1000 * i) % (2**16)) for i in range(self.buffer_size)]
 
-        # init auxillary buffers
-        self.segmtRcved = [0] * self.buffer_size
-        self.segmtSent = [0] * self.buffer_size
-        self.segmtTimer = [0] * self.buffer_size
+        # map every ACK seqno the receiver may request back to its pkt id
+        # pos buffer_size stands for the byte after the last (possibly partial) segment
+        # seqno repeats every 8192 pkts, so colliding pkt ids are kept together as candidates
+        for i in range(0, self.buffer_size + 1):
+            self.seqno_to_pos.setdefault((self.DSN + min(1000 * i, self.data_size)) % (2**16), []).append(i)
 
         # setup initial window boundaries
         self.win_ub = min(self.win_size - 1, self.buffer_size - 1)
@@ -487,44 +584,118 @@ class Sender:
         # send non-data segment (with flag != 0)
         if flag != 0:
             
-            logging.info(f"snd\t{self.get_time()}\t{self.get_type(flag)}\t{seqno}\t0")
-            print(f"{datetime.datetime.now()}\tsnd | type: {flag} | seqno: {seqno} | size: 0")
+            self._log("snd", flag, seqno, 0)
             
-            self.sender_socket.sendto(struct.pack('2H', flag, seqno), self.receiver_address)
+            self.sender_socket.sendto(self._HDR.pack(flag, seqno), self.receiver_address)
         
         # send data segment (with flag = 0)
         else:
+            self.sender_socket.sendmsg(self.patch_data(seqno, i), (), 0, self.receiver_address)
 
-            logging.info(f"snd\t{self.get_time()}\t{self.get_type(flag)}\t{seqno}\t{len(self.buffer[i])}")
-            print(f"{datetime.datetime.now()}\tsnd | type: {flag} | seqno: {seqno} | size: {len(self.buffer[i])}")
 
-            self.sender_socket.sendto(struct.pack('2H', flag, seqno) + self.buffer[i], self.receiver_address)
+    # data segment patching utility
+    # log the data segment and return its header and payload buffers ready to be sent
+    def patch_data(self, seqno, i):
 
+        self._log("snd", 0, seqno, self.lens[i])
+
+        return (self._hdr_for[i], self._data_mv[i*1000:i*1000 + self.lens[i]])
 
-    # segment type decoding utility
-    # convert stp type from int to str
-    def get_type(self, i):
-        
-        if i == 0:
-            return "DATA"
-        elif i == 1:
-            return "ACK"
-        elif i == 2:
-            return "SYN"
-        elif i == 3:
-            return "FIN"
-        else:
-            return "RESET"
+
+    # batch segment sending utility
+    # send all packets with a single sendmmsg syscall, or one sendmsg each where unsupported
+    # each packet is a (header, payload) pair of buffers
+    # UDP GSO (UDP_SEGMENT) is not used: the kernel would split one buffer into datagrams that share a header,
+    # but every stp segment carries its own seqno, so distinct headers force one message per segment
+    def _sendmmsg_batch(self, packets):
+
+        if _sendmmsg is None:
+            for pkt in packets:
+                self.sender_socket.sendmsg(pkt, (), 0, self.receiver_address)
+            return
+
+        # two iovecs per packet, pointing straight into the header bytes and the data buffer
+        # payload ctypes views are kept alive until the syscall returns
+        n = len(packets)
+        iov = (_iovec * (2 * n))()
+        msgs = (_mmsghdr * n)()
+        views = []
+        for k, (head, payload) in enumerate(packets):
+            view = (ctypes.c_char * len(payload)).from_buffer(payload)
+            views.append(view)
+            iov[2*k].iov_base = ctypes.cast(ctypes.c_char_p(head), ctypes.c_void_p).value
+            iov[2*k].iov_len = len(head)
+            iov[2*k + 1].iov_base = ctypes.addressof(view)
+            iov[2*k + 1].iov_len = len(payload)
+            hdr = msgs[k].msg_hdr
+            hdr.msg_name = ctypes.addressof(self._c_addr)
+            hdr.msg_namelen = ctypes.sizeof(self._c_addr)
+            hdr.msg_iov = ctypes.pointer(iov[2*k])
+            hdr.msg_iovlen = 2
+
+        # sendmmsg may send fewer than requested, keep going until all are out
+        sent = 0
+        while sent < n:
+            r = _sendmmsg(self.sender_socket.fileno(), ctypes.addressof(msgs[sent]), n - sent, 0)
+            if r < 0:
+                err = ctypes.get_errno()
+                if err == errno.EINTR:
+                    continue
+                raise OSError(err, os.strerror(err))
+            sent += r
+
+
+    # ACK batching utility
+    # receive up to _RECV_MAX queued messages without blocking
+    # expect 4 bytes message since receiver does not send data
+    def _recvmmsg_batch(self):
+
+        if _recvmmsg is None:
+            messages = []
+            while len(messages) < _RECV_MAX:
+                try:
+                    incoming_message, _ = self.sender_socket.recvfrom(4, socket.MSG_DONTWAIT)  # 4-byte header
+                except BlockingIOError:
+                    break
+                messages.append(incoming_message)
+            return messages
+
+        while True:
+            r = _recvmmsg(self.sender_socket.fileno(), ctypes.addressof(self._rx_msgs), _RECV_MAX, socket.MSG_DONTWAIT, None)
+            if r >= 0:
+                break
+            err = ctypes.get_errno()
+            if err == errno.EINTR:
+                continue
+            if err in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return []
+            raise OSError(err, os.strerror(err))
+
+        return [self._rx_bufs[k].raw[:self._rx_msgs[k].msg_len] for k in range(r)]
 
 
     # timestamp utility for logging
+    # monotonic clock, so wall-clock adjustments cannot skew the trace
     def get_time(self):
         
         if self.itstamp == 0:
-            self.itstamp = time.time() * 1000  # adapt to milliseconds
+            self.itstamp = time.monotonic() * 1000  # adapt to milliseconds
             return 0
 
-        return round(time.time()*1000 - self.itstamp, 2)
+        return round(time.monotonic()*1000 - self.itstamp, 2)
+
+
+    # segment logging utility
+    # write one trace line to the log, echo it to stdout in DEBUG mode
+    # return the timestamp so callers can reuse it for related trace lines
+    def _log(self, tag, flag, seqno, size):
+
+        t = self.get_time()
+        log.info("%s\t%s\t%s\t%s\t%s", tag, t, _TYPE_NAMES[min(flag, 4)], seqno, size)
+        if DEBUG:
+            print(f"{t}\t{tag} | type: {flag} | seqno: {seqno} | size: {size}")
+
+        return t
 
 
     # send RESET and close
@@ -543,13 +714,22 @@ class Sender:
         self.active = False
 
         # write stats to log
-        logging.info(f"Data Transferred: {self.byteSent} bytes")
-        logging.info(f"Data Segments Sent: {self.segmtSent.count(1)}")
-        logging.info(f"Retransmitted Data Segments: {self.retransmit}")
-        logging.info(f"Duplicate Acknowledgements: {self.dupAck}")
+        log.info("Data Transferred: %s bytes", self.byteSent)
+        log.info("Data Segments Sent: %s", self.sent_count)
+        log.info("Retransmitted Data Segments: %s", self.retransmit)
+        log.info("Duplicate Acknowledgements: %s", self.dupAck)
 
         print(f"{datetime.datetime.now()}\t✓ CLOSE")
 
+        # wait for the listener to leave its loop, so no retransmission is slicing file data
+        if self.listener_thread.is_alive() and self.listener_thread is not current_thread():
+            self.listener_thread.join()
+
+        # unmap file data
+        if isinstance(self.data, mmap.mmap):
+            self._data_mv.release()
+            self.data.close()
+
         # close socket
         # self.sender_socket.close()
         